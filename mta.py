@@ -3,10 +3,16 @@
 
 import json
 import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
 from pathlib import Path
+from typing import NamedTuple
 
 # Use system CA certs (avoids permission issues with sudo)
 os.environ.setdefault("REQUESTS_CA_BUNDLE", "/etc/ssl/certs/ca-certificates.crt")
@@ -24,6 +30,18 @@ except ImportError:
 CONFIG_PATH = Path(__file__).parent / "config.json"
 FEED_BASE_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2F"
 
+# Persistent session so polls reuse keep-alive TLS connections. Every feed is on
+# the same host, so one pool sized for the concurrent fetches (8 subway feeds) is enough.
+SESSION = requests.Session()
+SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=8))
+SESSION.headers.update({"Accept-Encoding": "gzip"})
+
+# feed_id -> (etag, last_modified, FeedMessage), kept across polls for conditional GETs
+_feed_cache = {}
+
+# One FeedMessage per feed_id, cleared and refilled each poll instead of reallocated
+_feed_pool = {}
+
 
 @dataclass
 class Trip:
@@ -33,7 +51,18 @@ class Trip:
     leave_in: float
     board_str: str
     arrive_str: str
-    color: list
+    color_idx: int
+
+
+class RouteCfg(NamedTuple):
+    """A route from config.json with its per-poll constants precomputed."""
+    name: str
+    feed_id: str
+    origin: str
+    dest: str
+    walk_station_s: int
+    walk_office_s: int
+    color: tuple
 
 
 def load_config():
@@ -41,51 +70,123 @@ def load_config():
         return json.load(f)
 
 
-def fetch_feed(feed_id):
-    """Fetch and parse GTFS realtime feed."""
-    url = FEED_BASE_URL + feed_id
-    response = requests.get(url, timeout=10)
-    response.raise_for_status()
+def load_routes(config):
+    """Build RouteCfg entries for every route in the config."""
+    return [
+        RouteCfg(
+            name=r["name"],
+            feed_id=r["feed_id"],
+            origin=r["origin_stop"],
+            dest=r["dest_stop"],
+            walk_station_s=r["walk_to_station_min"] * 60,
+            walk_office_s=r["walk_to_office_min"] * 60,
+            # TODO: the R is currently pink, oops.
+            color=tuple(r.get("color", (255, 255, 255))),
+        )
+        for r in config["routes"]
+    ]
+
 
-    feed = gtfs_realtime_pb2.FeedMessage()
-    feed.ParseFromString(response.content)
+def fetch_feed(feed_id, cache=_feed_cache):
+    """Fetch and parse GTFS realtime feed, reusing the cached copy if unchanged."""
+    url = FEED_BASE_URL + feed_id
+    headers = {}
+    cached = cache.get(feed_id)
+    if cached:
+        etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    # Stream so the body is read in one piece instead of as joined chunks
+    # (response.content). The body is always read to the end, even the empty
+    # one on a 304, so closing the response returns the connection to the pool
+    # instead of dropping it.
+    with SESSION.get(url, headers=headers, timeout=10, stream=True) as response:
+        body = response.raw.read(decode_content=True)
+        if response.status_code == 304 and cached:
+            return cached[2]
+        response.raise_for_status()
+
+    feed = _feed_pool.get(feed_id)
+    if feed is None:
+        feed = _feed_pool[feed_id] = gtfs_realtime_pb2.FeedMessage()
+    # Drop the cache entry first so a failed parse can't be served on a later 304
+    cache.pop(feed_id, None)
+    feed.Clear()
+    feed.MergeFromString(body)
+    cache[feed_id] = (response.headers.get("ETag"), response.headers.get("Last-Modified"), feed)
     return feed
 
 
-def find_trips_for_route(feed, origin_stop, dest_stop):
-    """Find all trips that serve both origin and destination stops."""
-    trips = []
+def fetch_feed_safe(feed_id):
+    """Fetch a feed, logging and returning None on error (for use in a thread pool)."""
+    try:
+        return fetch_feed(feed_id)
+    except Exception as e:
+        print(f"{feed_id}: Error - {e}")
+        return None
 
-    for entity in feed.entity:
-        if not entity.HasField("trip_update"):
-            continue
 
+def find_trips_multi(feed, route_pairs):
+    """Find trips for several (origin, dest) stop pairs in a single pass over the feed.
+
+    Returns a dict mapping each pair's index in route_pairs to its list of
+    (trip_id, route_id, origin_time, dest_time) tuples.
+    """
+    stop_to_pairs = {}
+    for pair_idx, (origin_stop, dest_stop) in enumerate(route_pairs):
+        stop_to_pairs.setdefault(origin_stop, []).append((pair_idx, 0))
+        stop_to_pairs.setdefault(dest_stop, []).append((pair_idx, 1))
+    n_slots = 2 * len(route_pairs)
+    results = {pair_idx: [] for pair_idx in range(len(route_pairs))}
+    # Bind lookups used in the hot loop to locals
+    pairs_for_stop = stop_to_pairs.get
+
+    for entity in feed.entity:
+        # An unset trip_update reads as an empty default instance
         trip_update = entity.trip_update
-        origin_time = None
-        dest_time = None
+        stop_time_updates = trip_update.stop_time_update
+        if not stop_time_updates:
+            continue
 
-        for stop_time in trip_update.stop_time_update:
-            stop_id = stop_time.stop_id
+        times = {}  # pair_idx -> [origin_time, dest_time]
+        found = 0
 
-            if stop_id == origin_stop:
-                origin_time = stop_time.arrival.time
+        for stop_time in stop_time_updates:
+            hits = pairs_for_stop(stop_time.stop_id)
+            if hits is None:
+                continue
 
-            elif stop_id == dest_stop:
-                dest_time = stop_time.arrival.time
+            # An unset arrival (e.g. a departure-only terminal) reads as 0
+            arrival = stop_time.arrival.time
+            if not arrival:
+                continue
+            for pair_idx, role in hits:
+                pair_times = times.setdefault(pair_idx, [None, None])
+                if pair_times[role] is None:
+                    found += 1
+                pair_times[role] = arrival
+            if found == n_slots:
+                break
 
-        if origin_time and dest_time and origin_time < dest_time:
-            trips.append({
-                "trip_id": trip_update.trip.trip_id,
-                "route_id": trip_update.trip.route_id,
-                "origin_time": origin_time,
-                "dest_time": dest_time,
-            })
-    return trips
+        for pair_idx, (origin_time, dest_time) in times.items():
+            if origin_time is not None and dest_time is not None and origin_time < dest_time:
+                trip = trip_update.trip
+                results[pair_idx].append((trip.trip_id, trip.route_id, origin_time, dest_time))
+    return results
 
 
 def format_time(unix_ts):
     """Format unix timestamp as HH:MM."""
-    return datetime.fromtimestamp(unix_ts).strftime("%H:%M")
+    return _format_minute(int(unix_ts) // 60)
+
+
+@lru_cache(maxsize=512)
+def _format_minute(minute):
+    # Trips cluster on the same few minutes, so each HH:MM is only formatted once
+    return datetime.fromtimestamp(minute * 60).strftime("%H:%M")
 
 
 def setup_matrix(config):
@@ -120,87 +221,200 @@ def get_color(rgb):
     return _color_cache[key]
 
 
-def draw_routes(matrix, canvas, font, trips, best_name, row_height):
-    """Draw route info on the LED matrix."""
-    canvas.Clear()
+# graphics.Color for each route, indexed by Trip.color_idx; filled by prime_route_colors
+_route_colors = []
+
+
+def prime_route_colors(routes):
+    """Create each route's color once so drawing can index it by route."""
+    _route_colors[:] = [get_color(route.color) for route in routes]
+
 
-    y = row_height  # First row baseline
-    for trip in trips:
-        color = get_color(trip.color)
-        text = f"{trip.route_name.ljust(3)} {trip.total_min:.0f} {trip.leave_in:.0f}"
-        graphics.DrawText(canvas, font, 1, y, color, text)
-        y += row_height
+# route name -> (label text, pixel width), measured once at startup by prime_labels
+_labels = {}
 
+# Rows last drawn onto each of the two frame canvases that SwapOnVSync alternates between
+_drawn_rows = ([], [])
+_back_buffer = 0
+
+
+def prime_labels(font, names):
+    """Measure each route's fixed label once so rows can redraw just their numbers."""
+    for name in names:
+        text = f"{name.ljust(3)} "
+        _labels[name] = (text, sum(font.CharacterWidth(ord(c)) for c in text))
+
+
+def draw_routes(matrix, canvas, font, trips, best_name, row_height):
+    """Draw route info on the LED matrix, redrawing only rows that changed."""
+    global _back_buffer
+    draw_text = graphics.DrawText
+    black = get_color((0, 0, 0))
+
+    rows = [
+        (trip.route_name, trip.color_idx, f"{trip.total_min:.0f} {trip.leave_in:.0f}")
+        for trip in trips
+    ]
+    drawn = _drawn_rows[_back_buffer]
+
+    for i in range(max(len(rows), len(drawn))):
+        new = rows[i] if i < len(rows) else None
+        old = drawn[i] if i < len(drawn) else None
+        if new == old:
+            continue
+
+        # Erase by redrawing the old text in black instead of clearing the canvas
+        y = row_height * (i + 1)
+        if new and old and new[:2] == old[:2]:
+            # Same label in the same color; only the numbers after it changed
+            x = 1 + _labels[new[0]][1]
+            draw_text(canvas, font, x, y, black, old[2])
+            draw_text(canvas, font, x, y, _route_colors[new[1]], new[2])
+            continue
+        if old:
+            label, width = _labels[old[0]]
+            draw_text(canvas, font, 1, y, black, label)
+            draw_text(canvas, font, 1 + width, y, black, old[2])
+        if new:
+            label, width = _labels[new[0]]
+            color = _route_colors[new[1]]
+            draw_text(canvas, font, 1, y, color, label)
+            draw_text(canvas, font, 1 + width, y, color, new[2])
+
+    drawn[:] = rows
+    _back_buffer ^= 1
     return matrix.SwapOnVSync(canvas)
 
+
+def display_worker(matrix, font, row_height, display_queue):
+    """Own the LED matrix and draw each snapshot handed over by the poll loop."""
+    canvas = matrix.CreateFrameCanvas()
+    while True:
+        trips, best_name = display_queue.get()
+        try:
+            canvas = draw_routes(matrix, canvas, font, trips, best_name, row_height)
+        except Exception as e:
+            # Keep the thread alive so the panel recovers on the next snapshot.
+            # The frame may be half drawn, so blank it and forget its rows to
+            # force a full repaint.
+            print(f"Display: Error - {e}")
+            canvas.Clear()
+            _drawn_rows[_back_buffer].clear()
+
+
+def publish_snapshot(display_queue, snapshot):
+    """Hand a snapshot to the display thread, replacing one it hasn't drawn yet."""
+    try:
+        display_queue.get_nowait()
+    except queue.Empty:
+        pass
+    display_queue.put_nowait(snapshot)
+
+
 def main():
     config = load_config()
     poll_interval = config["poll_interval_seconds"]
+    max_arrival_s = config.get("max_arrival_minutes", 60) * 60
+    routes = load_routes(config)
 
-    # Setup LED matrix if available
-    matrix = None
-    canvas = None
-    font = None
-    row_height = 7
+    # Setup LED matrix if available; a separate thread drives it so
+    # SwapOnVSync never blocks polling
+    display_queue = None
     if HAS_MATRIX:
         matrix, font, row_height = setup_matrix(config)
-        canvas = matrix.CreateFrameCanvas()
+        prime_route_colors(routes)
+        prime_labels(font, [route.name for route in routes])
+        display_queue = queue.Queue(maxsize=1)
+        threading.Thread(
+            target=display_worker,
+            args=(matrix, font, row_height, display_queue),
+            daemon=True,
+        ).start()
         print("LED matrix initialized")
     else:
         print("Running in CLI mode (no LED matrix)")
 
-    feed_cache = {}
+    # Group routes by feed so each feed is scanned once for all of its routes
+    feed_routes = {}
+    for route_idx, route in enumerate(routes):
+        feed_routes.setdefault(route.feed_id, []).append(route_idx)
+    feed_pairs = {
+        feed_id: [(routes[i].origin, routes[i].dest) for i in route_idxs]
+        for feed_id, route_idxs in feed_routes.items()
+    }
+    unique_feed_ids = list(feed_routes)
+    # feed_id -> (header timestamp, find_trips_multi result) from the last scan
+    scan_cache = {}
+
+    # Poll on a fixed cadence; monotonic so wall-clock jumps don't skew it
+    next_tick = time.monotonic()
 
     while True:
         now = time.time()
-        feed_cache.clear()
 
         print(f"\n=== {datetime.now().strftime('%H:%M:%S')} ===")
 
-        all_trips = []
-
-        for route in config["routes"]:
-            feed_id = route["feed_id"]
-            route_name = route["name"]
+        # Fetch every feed concurrently; requests releases the GIL on socket I/O
+        with ThreadPoolExecutor(max_workers=max(1, len(unique_feed_ids))) as ex:
+            feeds = dict(zip(unique_feed_ids, ex.map(fetch_feed_safe, unique_feed_ids)))
 
-            if feed_id not in feed_cache:
-                try:
-                    feed_cache[feed_id] = fetch_feed(feed_id)
-                except Exception as e:
-                    print(f"{route_name}: Error - {e}")
-                    continue
+        route_trips = {}
+        for feed_id, route_idxs in feed_routes.items():
+            feed = feeds[feed_id]
+            if feed is None:
+                continue
 
-            feed = feed_cache[feed_id]
-            feed_trips = find_trips_for_route(feed, route["origin_stop"], route["dest_stop"])
+            # The trips only depend on the feed contents, so rescan only when the
+            # MTA publishes a new snapshot (304s and unchanged re-sends skip it)
+            version = feed.header.timestamp
+            cached = scan_cache.get(feed_id)
+            if version and cached and cached[0] == version:
+                found = cached[1]
+            else:
+                found = find_trips_multi(feed, feed_pairs[feed_id])
+                scan_cache[feed_id] = (version, found)
+
+            for pair_idx, route_idx in enumerate(route_idxs):
+                route_trips[route_idx] = found[pair_idx]
+
+        max_arrival = now + max_arrival_s
+        # (arrival_at_office, route_idx, origin_time); Trip objects are built after ranking
+        candidates = []
+
+        for route_idx, route in enumerate(routes):
+            if route_idx not in route_trips:
+                continue
 
-            walk_to_station = route["walk_to_station_min"] * 60
-            earliest_board = now + walk_to_station
-            catchable = [t for t in feed_trips if t["origin_time"] >= earliest_board]
+            # Filter catchable trips and by max arrival time in one pass
+            earliest_board = now + route.walk_station_s
+            walk_to_office = route.walk_office_s
+            catchable = False
+            for _, _, origin_time, dest_time in route_trips[route_idx]:
+                if origin_time < earliest_board:
+                    continue
+                catchable = True
+                arrival_at_office = dest_time + walk_to_office
+                if arrival_at_office <= max_arrival:
+                    candidates.append((arrival_at_office, route_idx, origin_time))
 
             if not catchable:
-                print(f"{route_name}: No trains")
-                continue
+                print(f"{route.name}: No trains")
 
-            walk_to_office = route["walk_to_office_min"] * 60
-            # TODO: the R is currently pink, oops.
-            color = route.get("color", [255, 255, 255])
-
-            for t in catchable:
-                arrival_at_office = t["dest_time"] + walk_to_office
-                all_trips.append(Trip(
-                    route_name=route_name,
-                    arrival_at_office=arrival_at_office,
-                    total_min=(arrival_at_office - now) / 60,
-                    leave_in=(t["origin_time"] - walk_to_station - now) / 60,
-                    board_str=format_time(t["origin_time"]),
-                    arrive_str=format_time(arrival_at_office),
-                    color=color,
-                ))
-
-        # Sort by arrival time and filter by max arrival time
-        all_trips.sort(key=lambda t: t.arrival_at_office)
-        max_arrival_min = config.get("max_arrival_minutes", 60)
-        all_trips = [t for t in all_trips if t.total_min <= max_arrival_min]
+        # Sort by arrival time
+        candidates.sort(key=itemgetter(0))
+
+        all_trips = []
+        for arrival_at_office, route_idx, origin_time in candidates:
+            route = routes[route_idx]
+            all_trips.append(Trip(
+                route_name=route.name,
+                arrival_at_office=arrival_at_office,
+                total_min=(arrival_at_office - now) / 60,
+                leave_in=(origin_time - route.walk_station_s - now) / 60,
+                board_str=format_time(origin_time),
+                arrive_str=format_time(arrival_at_office),
+                color_idx=route_idx,
+            ))
 
         for trip in all_trips:
             print(f"{trip.route_name}: Leave in {trip.leave_in:.0f}m, Board {trip.board_str} → Arrive {trip.arrive_str} ({trip.total_min:.0f} min)")
@@ -210,10 +424,16 @@ def main():
             print(f"\nBEST: {best_option}")
 
         # Update LED matrix (show top 9 - fits 64px height with 7px rows)
-        if matrix and all_trips:
-            canvas = draw_routes(matrix, canvas, font, all_trips[:9], best_option, row_height)
-
-        time.sleep(poll_interval)
+        if display_queue and all_trips:
+            publish_snapshot(display_queue, (all_trips[:9], best_option))
+
+        next_tick += poll_interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Overran the interval; resync rather than firing a burst of catch-up polls
+            next_tick = time.monotonic()
 
 
 if __name__ == "__main__":